@@ -1,9 +1,12 @@
 from src.process_parser import list_process, text_sparkline
+from textual import work
 from textual.app import App, ComposeResult
 from textual.widgets import Tree, Footer, OptionList
 from textual.containers import ScrollableContainer
 from textual.binding import Binding
 
+PROC_ROW = "{:<25}PID: {:<10}owner: {:<12}memory: {} {:.2f}%"
+
 
 class ProcessTreeApp(App):
     """
@@ -19,6 +22,10 @@ class ProcessTreeApp(App):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.sort_by = "pid"
+        self._sort_key_cache_for = None
+        self._snapshot = None
+        self._sorted_roots = []
+        self._sorted_children = {}
 
     BINDINGS = [
         Binding("q,й", "quit", "Quit the app"),
@@ -32,68 +39,139 @@ class ProcessTreeApp(App):
         yield Footer()
 
     def on_mount(self):
-        self.load_tree()
+        self.load_tree(refresh=True)
+
+    def load_tree(self, refresh: bool = True):
+        """
+        Rebuilds the process tree.
+
+        Args:
+            refresh (bool): If True, collects a new process snapshot in a background
+                            worker; the tree is rebuilt once the snapshot is ready.
+                            If False, re-sorts the previously collected one.
+        """
+        if refresh:
+            self.collect_snapshot()
+            return
+        if self._snapshot is None:
+            return
 
-    def load_tree(self):
+        self.sort_snapshot(*self._snapshot)
         tree = self.query_one(Tree)
-        tree.clear()
+        with self.batch_update():
+            tree.clear()
+            for pid in self._sorted_roots:
+                self.add_process_node(tree.root, pid)
+
+    @work(thread=True, exclusive=True)
+    def collect_snapshot(self):
+        """
+        Collects a process snapshot off the UI thread and hands it to show_snapshot.
+        """
         processes, children_map = list_process()
-        root_pids = [
-            pid for pid in processes if processes[pid]["ppid"] not in processes
-        ]
-
-        def sorter(pid):
-            proc = processes[pid]
-            match self.sort_by:
-                case "alphabet":
-                    return proc["name"].lower()
-                case "owner":
-                    return proc["username"].lower()
-                case "memory":
-                    return proc.get("memory_total", 0)
-                case _:
-                    return proc["pid"]
+        for proc in processes.values():
+            proc["_display"] = self.format_proc(proc)
+        self.call_from_thread(self.show_snapshot, (processes, children_map))
+
+    def show_snapshot(self, snapshot):
+        self._snapshot = snapshot
+        self._sort_key_cache_for = None
+        self.load_tree(refresh=False)
+
+    def sort_snapshot(self, processes, children_map):
+        """
+        Sorts the root processes and every children list of the snapshot
+        for the current sort mode.
+
+        The sort key is stored in every process entry ("_sk"), so sorting does not
+        need to re-evaluate the sort mode for each process. Keys and sorted lists
+        are recomputed only when the sort mode or the snapshot changes.
+        """
+        if self._sort_key_cache_for == self.sort_by:
+            return
+        match self.sort_by:
+            case "alphabet":
+                for proc in processes.values():
+                    proc["_sk"] = proc["name"].lower()
+            case "owner":
+                for proc in processes.values():
+                    proc["_sk"] = proc["username"].lower()
+            case "memory":
+                for proc in processes.values():
+                    proc["_sk"] = proc.get("memory_total", 0)
+            case _:
+                for proc in processes.values():
+                    proc["_sk"] = proc["pid"]
+
+        def key(pid):
+            return processes[pid]["_sk"]
 
         reverse = self.sort_by == "memory"
-        for pid in sorted(root_pids, key=sorter, reverse=reverse):
-            proc = processes[pid]
-            node = tree.root.add(self.format_proc(proc))
-            self.add_children_recursive(node, pid, processes, children_map)
+        attached = {
+            child_pid
+            for pid, child_pids in children_map.items()
+            if pid in processes
+            for child_pid in child_pids
+        }
+        root_pids = [pid for pid in processes if pid not in attached]
+        self._sorted_roots = sorted(root_pids, key=key, reverse=reverse)
+        self._sorted_children = {
+            pid: sorted(child_pids, key=key, reverse=reverse)
+            for pid, child_pids in children_map.items()
+        }
+        self._sort_key_cache_for = self.sort_by
+
+    def add_process_node(self, parent_node, pid):
+        """
+        Adds a node for the given process under parent_node.
+        The node stores the PID as its data; its children are added
+        only when it is expanded (see load_children).
+        """
+        processes, _ = self._snapshot
+        return parent_node.add(
+            processes[pid]["_display"],
+            data=pid,
+            allow_expand=pid in self._sorted_children,
+        )
 
-    def add_children_recursive(self, tree_node, pid, processes, children_map):
-        if pid not in children_map:
+    def load_children(self, tree_node):
+        """
+        Adds the child process nodes of tree_node, unless they are already loaded.
+        """
+        if tree_node.children or tree_node.data is None:
             return
-        child_pids = children_map[pid]
-
-        def sorter(pid):
-            proc = processes[pid]
-            match self.sort_by:
-                case "alphabet":
-                    return proc["name"].lower()
-                case "owner":
-                    return proc["username"].lower()
-                case "memory":
-                    return proc.get("memory_total", 0)
-                case _:
-                    return proc["pid"]
-
-        reverse = self.sort_by == "memory"
-        for child_pid in sorted(child_pids, key=sorter, reverse=reverse):
-            child_proc = processes[child_pid]
-            child_node = tree_node.add(self.format_proc(child_proc))
-            self.add_children_recursive(child_node, child_pid, processes, children_map)
+        for child_pid in self._sorted_children.get(tree_node.data, ()):
+            self.add_process_node(tree_node, child_pid)
+
+    def add_children(self, tree_node):
+        """
+        Loads the whole subtree under tree_node.
+        Walks the tree with an explicit stack, so deep process trees
+        do not hit the recursion limit.
+        """
+        stack = [tree_node]
+        while stack:
+            node = stack.pop()
+            self.load_children(node)
+            stack.extend(node.children)
+
+    def on_tree_node_expanded(self, event: Tree.NodeExpanded):
+        self.load_children(event.node)
 
     def format_proc(self, proc):
-        return (
-            f"{proc['name'].ljust(25)}"
-            f"PID: {str(proc['pid']).ljust(10)}"
-            f"owner: {proc['username'].ljust(12)}"
-            f"memory: {text_sparkline(proc['memory_total'])} {proc['memory_total']}%"
+        return PROC_ROW.format(
+            proc["name"],
+            proc["pid"],
+            proc["username"],
+            text_sparkline(proc["memory_total"]),
+            proc["memory_total"],
         )
 
     def action_expand_all(self):
         tree = self.query_one(Tree)
-        tree.root.expand_all()
+        with self.batch_update():
+            self.add_children(tree.root)
+            tree.root.expand_all()
 
     def action_collapse_all(self):
         tree = self.query_one(Tree)
@@ -110,7 +188,7 @@ class ProcessTreeApp(App):
                 self.sort_by = "owner"
             case "По Памяти":
                 self.sort_by = "memory"
-        self.load_tree()
+        self.load_tree(refresh=False)
 
 
 if __name__ == "__main__":
@@ -1,76 +1,225 @@
+from collections import defaultdict
+from functools import lru_cache
+
 import psutil
 
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+try:
+    import pywintypes
+    import win32api
+    import win32con
+    import win32security
+except ImportError:
+    win32security = None
+
+BARS = "▁▂▃▄▅▆▇█"
+SPARKLINE = tuple(BARS[percent * (len(BARS) - 1) // 100] for percent in range(101))
+
 
-def get_parent_tree(proc: psutil.Process) -> dict:
+def group_by_depth(parent_idx: list) -> list:
     """
-    Recursively retrieves the parent process tree for the given process.
+    Groups processes by their depth in the process tree.
+
+    Processes are referred to by their index in the snapshot lists built by list_process.
+    A ppid cycle (possible after PID reuse) is detected once, while depths are computed:
+    the parent links of all its members are removed from parent_idx (set to -1), so every
+    member becomes a root and no later pass has to guard against cycles.
 
     Args:
-        proc (psutil.Process): The process whose parent tree is to be constructed.
+        parent_idx (list): Index of the parent of every process, or -1 if the parent
+                           is not part of the snapshot. Modified in place.
 
     Returns:
-        dict: A dictionary containing information about the parent process:
+        list: List of levels, each a list of process indices; level 0 holds the roots.
+    """
+    depth = [-1] * len(parent_idx)
+    walk = [-1] * len(parent_idx)
+    for index in range(len(parent_idx)):
+        chain = []
+        current = index
+        while current != -1 and depth[current] == -1 and walk[current] != index:
+            walk[current] = index
+            chain.append(current)
+            current = parent_idx[current]
+
+        if current != -1 and depth[current] == -1:
+            cycle_start = chain.index(current)
+            for member in chain[cycle_start:]:
+                parent_idx[member] = -1
+                depth[member] = 0
+            del chain[cycle_start:]
+
+        base = -1 if current == -1 else depth[current]
+        for offset, child in enumerate(reversed(chain), 1):
+            depth[child] = base + offset
+
+    levels = [[] for _ in range(max(depth, default=-1) + 1)]
+    for index, level in enumerate(depth):
+        levels[level].append(index)
+
+    return levels
+
+
+def build_parent_trees(
+    pids: list, names: list, memory: list, parent_idx: list, levels: list
+) -> list:
+    """
+    Builds the parent process tree for every process from an already collected snapshot.
+
+    Processes are visited from the top level down, so the tree of every parent is
+    complete before it is shared with its children.
+
+    Args:
+        pids (list): Process IDs.
+        names (list): Process names.
+        memory (list): Memory usage of every process in percent.
+        parent_idx (list): Parent indices, as returned by group_by_depth.
+        levels (list): Processes grouped by depth, as returned by group_by_depth.
+
+    Returns:
+        list: Parent tree of every process:
             - "ppid": Parent process ID (int)
             - "name": Parent process name (str)
-            - "ppids": Nested dictionary with the parent's own parent information (recursive)
-        Returns an empty dictionary if the process has no parent or if access is denied.
+            - "ppids": The parent's own parent tree (dict, shared with the parent entry)
+            - "memory": Parent memory usage in percent (float)
+        The tree is an empty dictionary if the parent is not part of the snapshot.
+    """
+    trees = [None] * len(pids)
+    for level in levels:
+        for index in level:
+            parent = parent_idx[index]
+            if parent == -1:
+                trees[index] = {}
+                continue
+            trees[index] = {
+                "ppid": pids[parent],
+                "name": names[parent],
+                "ppids": trees[parent],
+                "memory": memory[parent],
+            }
+
+    return trees
+
+
+def compute_memory_totals(memory: list, parent_idx: list, levels: list) -> list:
+    """
+    Computes the memory usage of every process together with all of its descendants.
+
+    Processes are visited from the deepest level up and each one adds its total
+    to its parent, so every total is final before it is propagated.
+
+    Args:
+        memory (list): Memory usage of every process in percent.
+        parent_idx (list): Parent indices, as returned by group_by_depth.
+        levels (list): Processes grouped by depth, as returned by group_by_depth.
+
+    Returns:
+        list: Memory usage in percent of every process, including descendants (float).
+    """
+    totals = list(memory)
+    for level in reversed(levels[1:]):
+        for index in level:
+            totals[parent_idx[index]] += totals[index]
+
+    return totals
+
 
-    Exceptions:
-        psutil.NoSuchProcess: If the process no longer exists.
-        psutil.AccessDenied: If access to process information is denied.
+@lru_cache(maxsize=1024)
+def sid_to_name(sid: str) -> str:
+    """
+    Translates a Windows SID string to an account name without the domain.
+    Returns the SID string itself if it has no account (e.g. a deleted user).
+    Results are cached for the lifetime of the process.
     """
     try:
-        parent = proc.parent()
-        if parent is None:
-            return {}
-        return {
-            "ppid": parent.pid,
-            "name": parent.name(),
-            "ppids": get_parent_tree(parent),
-            "memory": round(parent.memory_percent(), 2),
-        }
-    except (psutil.NoSuchProcess, psutil.AccessDenied):
-        return {}
+        name, _, _ = win32security.LookupAccountSid(
+            None, win32security.ConvertStringSidToSid(sid)
+        )
+    except pywintypes.error:
+        return sid
+    return name
 
 
-def compute_memory_with_children(pid, processes, children_map, memo, visited=None):
-    if visited is None:
-        visited = set()
-    if pid in memo:
-        return memo[pid]
+def get_windows_username(pid: int) -> str:
+    """
+    Returns the owner name of a Windows process, translating its SID through sid_to_name.
+    Returns "unknown" if the process token cannot be read.
+    """
+    if pid in (0, 4):
+        return "SYSTEM"
+    try:
+        handle = win32api.OpenProcess(
+            win32con.PROCESS_QUERY_LIMITED_INFORMATION, False, pid
+        )
+        try:
+            token = win32security.OpenProcessToken(handle, win32security.TOKEN_QUERY)
+            try:
+                sid, _ = win32security.GetTokenInformation(
+                    token, win32security.TokenUser
+                )
+            finally:
+                token.Close()
+        finally:
+            handle.Close()
+        return sid_to_name(win32security.ConvertSidToStringSid(sid))
+    except pywintypes.error:
+        return "unknown"
 
-    if pid in visited:
-        return 0
 
-    visited.add(pid)
+def get_username(info: dict, user_cache: dict) -> str:
+    """
+    Returns the owner name of a process without the Windows domain prefix.
 
-    total = processes[pid]["memory"]
-    for child_pid in children_map.get(pid, []):
-        if child_pid in processes:
-            total += compute_memory_with_children(
-                child_pid, processes, children_map, memo, visited
-            )
+    On POSIX the name is resolved from the real UID and cached in user_cache,
+    so every user is looked up only once per snapshot. On Windows with pywin32
+    installed the process SID is translated through sid_to_name.
 
-    visited.remove(pid)
+    Args:
+        info (dict): Process info from psutil.process_iter, with "uids", "username"
+                     or neither (Windows with pywin32).
+        user_cache (dict): Mapping of UID to user name, shared within a snapshot.
 
-    memo[pid] = round(total, 2)
-    return memo[pid]
+    Returns:
+        str: User name, the UID if it has no user entry, or "unknown" if access is denied.
+    """
+    if "uids" in info:
+        uids = info["uids"]
+        if uids is None:
+            return "unknown"
+        uid = uids.real
+        if uid not in user_cache:
+            try:
+                user_cache[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                user_cache[uid] = str(uid)
+        return user_cache[uid]
+
+    if "username" in info:
+        return (info["username"] or "unknown").rpartition("\\")[2]
+
+    return get_windows_username(info["pid"])
 
 
-def list_process(filter=None) -> tuple:
+def list_process(filter=None, parent_trees: bool = False) -> tuple:
     """
     Lists system processes, optionally filtered by process name or PID.
-    For each matched process, includes its parent process tree.
+    For each matched process, optionally includes its parent process tree.
     Args:
         filter (str or int, optional): If an integer or string representing a PID, filter for that PID.
                                        If a string, filter for processes with that name.
                                        If None, lists all processes.
+        parent_trees (bool): If True, adds the parent process tree ("ppids") to every process.
+                             The trees are built over all processes, regardless of filter.
     Returns:
         list: List of dictionaries, each with details about a process:
             - "pid": Process ID (int)
             - "name": Process name (str)
             - "username": process Owner (str)
-            - "ppids": Parent process tree (dict, see get_parent_tree)
+            - "ppids": Parent process tree (dict, see build_parent_trees), only with parent_trees
     """
     pid = None
     name = None
@@ -80,50 +229,91 @@ def list_process(filter=None) -> tuple:
         except ValueError:
             name = filter.lower()
 
-    processes = {}
-    children_map = {}
+    pids = []
+    ppids = []
+    names = []
+    usernames = []
+    memory = []
+    matched = []
+    children_map = defaultdict(list)
+    total_memory = psutil.virtual_memory().total
+    user_cache = {}
+    attrs = ["pid", "ppid", "name"]
+    if pwd is not None:
+        attrs.append("uids")
+    elif win32security is None:
+        attrs.append("username")
 
-    for proc in psutil.process_iter(["pid", "ppid", "name", "username"]):
+    for proc in psutil.process_iter(attrs):
         try:
             info = proc.info
             proc_name = info["name"] or ""
-            if pid is not None and info["pid"] != pid:
-                continue
-            if name is not None and proc_name.lower() != name:
+            is_match = (pid is None or info["pid"] == pid) and (
+                name is None or proc_name.lower() == name
+            )
+            if not is_match and not parent_trees:
                 continue
 
-            processes[info["pid"]] = {
-                "pid": info["pid"],
-                "ppid": info["ppid"],
-                "name": proc_name,
-                "username": (info["username"] or "unknown").split("\\")[-1],
-                "memory": round(proc.memory_percent(), 2),
-                "ppids": get_parent_tree(proc),
-            }
+            rss = proc.memory_info().rss
 
-            children_map.setdefault(info["ppid"], []).append(info["pid"])
+            pids.append(info["pid"])
+            ppids.append(info["ppid"])
+            names.append(proc_name)
+            usernames.append(get_username(info, user_cache) if is_match else None)
+            memory.append(rss / total_memory * 100)
+            matched.append(is_match)
 
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
 
-    memo = {}
-    for pid in processes:
-        processes[pid]["memory_total"] = compute_memory_with_children(
-            pid, processes, children_map, memo
+    trees = None
+    if parent_trees:
+        pid_to_idx = {proc_pid: index for index, proc_pid in enumerate(pids)}
+        parent_idx = [pid_to_idx.get(ppid, -1) for ppid in ppids]
+        levels = group_by_depth(parent_idx)
+        trees = build_parent_trees(pids, names, memory, parent_idx, levels)
+
+    selected = [index for index, is_match in enumerate(matched) if is_match]
+    if len(selected) != len(pids):
+        pids, ppids, names, usernames, memory = (
+            [values[index] for index in selected]
+            for values in (pids, ppids, names, usernames, memory)
         )
+        if trees is not None:
+            trees = [trees[index] for index in selected]
+
+    pid_to_idx = {proc_pid: index for index, proc_pid in enumerate(pids)}
+    parent_idx = [pid_to_idx.get(ppid, -1) for ppid in ppids]
+    levels = group_by_depth(parent_idx)
+    for index, ppid in enumerate(ppids):
+        if parent_idx[index] != -1 or ppid not in pid_to_idx:
+            children_map[ppid].append(pids[index])
+    memory_totals = compute_memory_totals(memory, parent_idx, levels)
+
+    processes = {}
+    for index, proc_pid in enumerate(pids):
+        processes[proc_pid] = {
+            "pid": proc_pid,
+            "ppid": ppids[index],
+            "name": names[index],
+            "username": usernames[index],
+            "memory": memory[index],
+            "memory_total": memory_totals[index],
+        }
+
+    if trees is not None:
+        for index, proc_pid in enumerate(pids):
+            processes[proc_pid]["ppids"] = trees[index]
 
-    return processes, children_map
+    return processes, dict(children_map)
 
 
 def text_sparkline(memory_percent: float):
-    bars = "▁▂▃▄▅▆▇█"
-    maximum = len(bars) - 1
-    index = int(memory_percent * maximum / 100)
-    return bars[index]
+    return SPARKLINE[min(int(memory_percent), 100)]
 
 
 if __name__ == "__main__":
     import json
 
-    print(json.dumps(list_process("librewolf.exe"), indent=4))
+    print(json.dumps(list_process("librewolf.exe", parent_trees=True), indent=4))
     # print(text_sparkline(50))